@@ -248,9 +248,9 @@ async fn get_video_metadata(app: AppHandle, path: String) -> Result<video::Video
 }
 
 #[tauri::command]
-async fn detect_encoders(app: AppHandle) -> Result<video::DetectionReport, String> {
+async fn detect_encoders(app: AppHandle, force: Option<bool>) -> Result<video::DetectionReport, String> {
     let ffmpeg_path = resolve_ffmpeg_path(&app);
-    Ok(video::detect_system_encoders(&ffmpeg_path, app))
+    Ok(video::detect_system_encoders(&ffmpeg_path, app, !force.unwrap_or(false)))
 }
 
 #[tauri::command]
@@ -1,6 +1,7 @@
 use serde::{Deserialize, Serialize};
 use std::path::Path;
-use std::process::{Command, Stdio};
+use std::process::{Child, Command, ExitStatus, Output, Stdio};
+use std::time::{Duration, Instant};
 use std::io::{BufRead, BufReader};
 use walkdir::WalkDir;
 use tauri::{AppHandle, Emitter, Manager};
@@ -146,6 +147,37 @@ pub struct VmafState {
     pub crf_history: std::collections::HashMap<(u32, u32), Vec<(f32, f64)>>,
 }
 
+/// 依赖硬件或系统框架的视频编码器关键字（如 Windows 上的 Media Foundation `_mf`、Vulkan），
+/// 这类编码器出现在列表中不代表能打开，需实际编码一帧验证
+const HW_ENCODER_KEYWORDS: &[&str] = &[
+    "nvenc", "amf", "qsv", "cuda", "vaapi", "vdpau", "d3d12va",
+    "_mf", "vulkan", "v4l2m2m", "videotoolbox", "mediacodec", "omx", "rkmpp",
+];
+
+/// 视频编码器测试编码的输入。720p yuv420p 是实际压缩的典型输入，可过滤掉有分辨率或像素格式限制的编码器
+/// （如 h261、dnxhd），部分硬件编码器也有最小分辨率限制（如 NVENC 要求不小于 128x128）
+const VIDEO_PROBE_INPUT: &str = "color=size=1280x720:rate=30";
+
+/// 普通 ffmpeg 查询与测试编码的时限，防止驱动异常导致检测卡死
+const QUERY_TIMEOUT: Duration = Duration::from_secs(5);
+const ENCODE_PROBE_TIMEOUT: Duration = Duration::from_secs(15);
+
+/// 硬件编码器因设备/驱动缺失而初始化失败时 ffmpeg 常见的错误信息（小写）。
+/// 其中部分信息也可能只针对某个编码格式（如不支持 AV1 的 GPU 上 av1_nvenc 报 "no capable devices"），
+/// 因此只用于判断家族代表编码器的失败原因
+const HW_DEVICE_ERROR_MARKERS: &[&str] = &[
+    "cannot load",
+    "no device",
+    "no capable devices",
+    "device creation failed",
+    "failed to initialise",
+    "failed to initialize",
+    "initialization failed",
+    "init failed",
+    "no va display",
+    "failed to open",
+];
+
 const VIDEO_EXTENSIONS: &[&str] = &["mp4", "mkv", "avi", "mov", "flv", "wmv", "webm", "m4v", "mpg", "mpeg", "3gp", "ts","asf", "rmvb", "vob","m2ts","f4v","mts","ogv", "divx","xvid","rm"];
 
 /// Check if a path is a video file based on its extension
@@ -304,133 +336,538 @@ pub struct DetectionProgress {
     pub available: bool,
 }
 
-pub fn detect_system_encoders(ffmpeg_path: &str, app: AppHandle) -> DetectionReport {
-    let mut report = DetectionReport {
-        video: Vec::new(),
-        audio: Vec::new(),
-        log: Vec::new(),
-    };
+/// 检测逻辑版本。修改探测方式或编码器分类（如硬件关键字）时递增，使旧缓存失效
+const ENCODER_DETECTION_SCHEMA: u32 = 2;
+
+/// 检测结果缓存文件内容，`key` 由应用版本、检测逻辑版本、ffmpeg 路径和 `ffmpeg -version` 输出计算
+#[derive(Debug, Serialize, Deserialize)]
+struct EncoderDetectionCache {
+    key: String,
+    report: DetectionReport,
+}
+
+/// 检测系统可用的编码器。
+/// `use_cache` 为 true 时优先读取上次的检测结果（同一 ffmpeg 构建）；为 false 时重新探测并刷新缓存。
+/// 设置环境变量 `FFMPEG_ENCODER_CACHE=0` 可完全绕过缓存（不读、不写，也不计算缓存键）
+pub fn detect_system_encoders(ffmpeg_path: &str, app: AppHandle, use_cache: bool) -> DetectionReport {
+    if std::env::var("FFMPEG_ENCODER_CACHE").map_or(false, |v| v == "0") {
+        return probe_system_encoders(ffmpeg_path, &app).0;
+    }
+
+    let cache_file = app.path().app_cache_dir().ok().map(|dir| dir.join("ffmpeg_encoders.json"));
+    let key = ffmpeg_version_key(ffmpeg_path);
+
+    if use_cache {
+        let cached = cache_file.as_ref()
+            .and_then(|f| std::fs::read_to_string(f).ok())
+            .and_then(|content| serde_json::from_str::<EncoderDetectionCache>(&content).ok())
+            .filter(|cache| key.as_deref() == Some(cache.key.as_str()));
+        if let Some(cache) = cached {
+            let mut report = cache.report;
+            report.log.push("Loaded encoder detection result from cache".to_string());
+            return report;
+        }
+    }
+
+    let (report, timed_out) = probe_system_encoders(ffmpeg_path, &app);
+
+    // ffmpeg 无法运行或有探测超时时不写缓存，避免把偶发超时当作不可用长期保留
+    if let (Some(file), Some(key)) = (cache_file, key) {
+        if !timed_out && (!report.video.is_empty() || !report.audio.is_empty()) {
+            let cache = EncoderDetectionCache { key, report: report.clone() };
+            if let Some(dir) = file.parent() {
+                let _ = std::fs::create_dir_all(dir);
+            }
+            if let Ok(content) = serde_json::to_string_pretty(&cache) {
+                let _ = std::fs::write(&file, content);
+            }
+        }
+    }
+
+    report
+}
+
+/// 计算缓存键。ffmpeg 更换或升级、应用更新或检测逻辑变化后缓存自动失效
+fn ffmpeg_version_key(ffmpeg_path: &str) -> Option<String> {
+    use std::hash::{Hash, Hasher};
 
-    // 1. Get raw list
     let mut command = Command::new(ffmpeg_path);
-    command.arg("-encoders");
+    command.arg("-version").stdout(Stdio::piped()).stderr(Stdio::null());
     #[cfg(windows)]
     {
         use std::os::windows::process::CommandExt;
         command.creation_flags(0x08000000);
     }
-    let output = match command.output() {
-        Ok(o) => String::from_utf8_lossy(&o.stdout).to_string(),
-        Err(e) => {
-            report.log.push(format!("Failed to run ffmpeg: {}", e));
-             return report;
-        }
-    };
 
-    let mut all_video = Vec::new();
-    let mut all_audio = Vec::new();
+    let o = output_with_timeout(&mut command, QUERY_TIMEOUT).ok()?;
+    if !o.status.success() { return None; }
 
-    for line in output.lines() {
-        let line = line.trim();
-        if line.is_empty() || line.starts_with('-') || line.starts_with('=') { continue; }
-        
-        let parts: Vec<&str> = line.split_whitespace().collect();
-        if parts.len() < 3 { continue; }
+    let mut hasher = std::collections::hash_map::DefaultHasher::new();
+    env!("CARGO_PKG_VERSION").hash(&mut hasher);
+    ENCODER_DETECTION_SCHEMA.hash(&mut hasher);
+    ffmpeg_path.hash(&mut hasher);
+    o.stdout.hash(&mut hasher);
+    Some(format!("{:016x}", hasher.finish()))
+}
+
+/// 探测系统编码器，返回检测报告以及结果是否不完整（编码器列表获取失败或有探测超时）
+fn probe_system_encoders(ffmpeg_path: &str, app: &AppHandle) -> (DetectionReport, bool) {
+    use std::collections::HashMap;
+    use std::sync::atomic::{AtomicBool, Ordering};
 
-        let flags = parts[0];
-        let name = parts[1];
-        let description = parts[2..].join(" ");
+    // 超时的探测结果不可靠（可能只是系统繁忙），用于决定是否写入持久缓存
+    let timed_out = AtomicBool::new(false);
 
-        if flags.starts_with('V') {
-            all_video.push((name.to_string(), description));
-        } else if flags.starts_with('A') {
-            all_audio.push((name.to_string(), description));
+    let mut report = DetectionReport {
+        video: Vec::new(),
+        audio: Vec::new(),
+        log: Vec::new(),
+    };
+
+    // 1. Get raw list
+    let (all_video, all_audio) = match get_encoder_listing(ffmpeg_path) {
+        Ok(listing) => listing,
+        Err(e) => {
+            report.log.push(e);
+            return (report, true);
         }
-    }
+    };
 
     // 2. Filter & Test Video
-    let hw_keywords = ["nvenc", "amf", "qsv", "cuda", "vaapi", "vdpau","d3d12va"];
+    // 每个探测都是独立的 ffmpeg 进程，耗时主要在进程启动上，并发执行即可线性缩短总耗时
+    // 探测时固定 -threads 1，避免多个进程各自占满所有核心；lavfi 输入无需探测，关闭输入分析
+    // 硬件编码器按家族（nvenc、qsv 等）分组，组内顺序探测。以支持最广的 h264 编码器作为家族代表最先探测，
+    // 若代表因设备/驱动缺失失败，同家族其余编码器必然同样失败，直接跳过；
+    // 其余编码器的失败可能只针对该编码格式（如不支持 AV1 的 GPU），不影响同家族其他编码器
+    let hw_family = |name: &str| HW_ENCODER_KEYWORDS.iter().copied().find(|k| name.contains(k));
+
+    let mut tasks: Vec<Vec<&str>> = Vec::new();
+    let mut family_task: HashMap<&str, usize> = HashMap::new();
+    for (name, _) in &all_video {
+        match hw_family(name) {
+            Some(family) => {
+                let idx = *family_task.entry(family).or_insert_with(|| {
+                    tasks.push(Vec::new());
+                    tasks.len() - 1
+                });
+                tasks[idx].push(name.as_str());
+            }
+            None => tasks.push(vec![name.as_str()]),
+        }
+    }
+    for &idx in family_task.values() {
+        tasks[idx].sort_by_key(|name| !name.starts_with("h264_"));
+    }
+
+    // 当前 ffmpeg 构建支持的硬件设备类型，用于按家族预先检测设备能否打开；列表中没有硬件编码器时无需查询
+    let hw_device_types = if family_task.is_empty() { Vec::new() } else { get_hw_device_types(ffmpeg_path) };
+
+    let video_results = run_parallel(&tasks, |names| {
+        let mut results = Vec::new();
+        let mut logs = Vec::new();
+        let mut family_dead = false;
+        let mut device_opened = false;
+
+        // 整个家族只初始化一次设备；设备打不开时无需逐个探测编码器。
+        // 若该构建不支持对应设备类型（如较旧版本没有 amf），则退回逐个探测
+        let device = names.first()
+            .and_then(|name| hw_family(name))
+            .and_then(hw_device_type)
+            .filter(|device| hw_device_types.iter().any(|t| t == device));
+        if let Some(device) = device {
+            let init = format!("{}=hw", device);
+            let args = [
+                "-y", "-hide_banner", "-v", "error",
+                "-init_hw_device", init.as_str(),
+                "-f", "lavfi", "-i", "nullsrc=s=16x16",
+                "-frames:v", "1", "-f", "null", "-"
+            ];
+            match probe_encoder(ffmpeg_path, &args) {
+                Ok(()) => device_opened = true,
+                Err(ProbeError::Timeout) => {
+                    timed_out.store(true, Ordering::Relaxed);
+                    family_dead = true;
+                    logs.push(format!("{} device: timed out", device));
+                }
+                Err(ProbeError::Failed(stderr)) => {
+                    family_dead = true;
+                    logs.push(format!("{} device: {}", device, stderr_tail(&stderr, 3)));
+                }
+            }
+        }
 
-    for (name, desc) in all_video {
-        let is_hw = hw_keywords.iter().any(|k| name.contains(k));
+        for (i, &name) in names.iter().enumerate() {
+            let is_hw = hw_family(name).is_some();
+            // 设备已确认可以打开时，编码器的失败只说明该编码器本身不可用
+            let is_representative = is_hw && i == 0 && !device_opened;
+            let mut log = None;
 
-        let args = [
-            "-y", "-hide_banner", "-v", "error",
-            "-f", "lavfi", "-i", "color=size=1280x720:rate=30",
-            "-frames:v", "1", "-pix_fmt", "yuv420p",
-            "-c:v", &name, "-f", "null", "-"
-        ];
-        
-        let mut command = Command::new(ffmpeg_path);
-        command.args(&args);
-        #[cfg(windows)]
-        {
-            use std::os::windows::process::CommandExt;
-            command.creation_flags(0x08000000);
+            // 出现在列表中不代表可用：软件编码器可能有分辨率/像素格式限制或属于实验性编码器，
+            // 硬件编码器可能缺少驱动（如 QSV），因此都实际编码一帧
+            let available = if family_dead {
+                log = Some(format!("{}: skipped, device unavailable", name));
+                false
+            } else {
+                let args = [
+                    "-y", "-hide_banner", "-v", "error",
+                    "-probesize", "32", "-analyzeduration", "0", "-fpsprobesize", "0",
+                    "-f", "lavfi", "-i", VIDEO_PROBE_INPUT,
+                    "-frames:v", "1", "-pix_fmt", "yuv420p",
+                    "-threads", "1", "-c:v", name, "-f", "null", "-"
+                ];
+                match probe_encoder(ffmpeg_path, &args) {
+                    Ok(()) => true,
+                    // 驱动异常时 ffmpeg 可能卡在设备初始化，代表超时则同家族其余编码器不再尝试
+                    Err(ProbeError::Timeout) => {
+                        timed_out.store(true, Ordering::Relaxed);
+                        family_dead = is_representative;
+                        log = Some(format!("{}: timed out", name));
+                        false
+                    }
+                    // 软件编码器不支持测试输入属于常态，不记录日志
+                    Err(ProbeError::Failed(stderr)) => {
+                        if is_hw {
+                            family_dead = is_representative && is_device_error(&stderr);
+                            log = Some(format!("{}: {}", name, stderr_tail(&stderr, 3)));
+                        }
+                        false
+                    }
+                }
+            };
+
+            // 发送进度事件
+            let _ = app.emit("encoder-detection-progress", DetectionProgress {
+                r#type: "video".to_string(),
+                name: if is_hw { format!("{} (HW)", name) } else { format!("{} (CPU)", name) },
+                value: name.to_string(),
+                available,
+            });
+            logs.extend(log);
+            results.push((name.to_string(), available));
         }
-        
-        let available = match command.output() {
-            Ok(o) if o.status.success() => {
-                let display_name = if is_hw { format!("{} (HW)", name) } else { format!("{} (CPU)", name) };
-                report.video.push(DetectedEncoder {
-                    name: display_name.clone(),
-                    value: name.clone(),
-                    is_hardware: is_hw,
-                    description: desc.clone(),
-                });
-                true
-            },
-            _ => false
-        };
+        (results, logs)
+    });
 
-        // 发送进度事件
-        let _ = app.emit("encoder-detection-progress", DetectionProgress {
-            r#type: "video".to_string(),
-            name: if is_hw { format!("{} (HW)", name) } else { format!("{} (CPU)", name) },
-            value: name,
-            available,
+    let mut video_available = HashMap::new();
+    for (results, logs) in video_results {
+        report.log.extend(logs);
+        video_available.extend(results);
+    }
+
+    // 按原始列表顺序汇总，保证结果稳定
+    for (name, desc) in &all_video {
+        if !video_available.get(name).copied().unwrap_or(false) { continue; }
+        let is_hw = hw_family(name).is_some();
+        let display_name = if is_hw { format!("{} (HW)", name) } else { format!("{} (CPU)", name) };
+        report.video.push(DetectedEncoder {
+            name: display_name,
+            value: name.clone(),
+            is_hardware: is_hw,
+            description: desc.clone(),
         });
     }
 
     // 3. Filter & Test Audio
-    for (name, desc) in all_audio {
+    // 同样实际编码一秒立体声，过滤掉实验性编码器（如原生 opus、vorbis）和不支持立体声的编码器
+    let audio_results = run_parallel(&all_audio, |(name, _)| {
+        let mut log = None;
         let args = [
             "-y", "-hide_banner", "-v", "error",
+            "-probesize", "32", "-analyzeduration", "0",
             "-f", "lavfi", "-i", "anullsrc=r=44100:cl=stereo",
-            "-t", "1", "-c:a", &name, "-f", "null", "-"
+            "-t", "1", "-threads", "1", "-c:a", name.as_str(), "-f", "null", "-"
         ];
-
-        let mut command = Command::new(ffmpeg_path);
-        command.args(&args);
-        #[cfg(windows)]
-        {
-            use std::os::windows::process::CommandExt;
-            command.creation_flags(0x08000000);
-        }
-
-        let available = match command.output() {
-            Ok(o) if o.status.success() => {
-                report.audio.push(DetectedEncoder {
-                    name: format!("{} (CPU)", name),
-                    value: name.clone(),
-                    is_hardware: false,
-                    description: desc.clone(),
-                });
-                true
-            },
-            _ => false
+        let available = match probe_encoder(ffmpeg_path, &args) {
+            Ok(()) => true,
+            Err(ProbeError::Timeout) => {
+                timed_out.store(true, Ordering::Relaxed);
+                log = Some(format!("{}: timed out", name));
+                false
+            }
+            Err(ProbeError::Failed(_)) => false,
         };
 
         // 发送进度事件
         let _ = app.emit("encoder-detection-progress", DetectionProgress {
             r#type: "audio".to_string(),
             name: format!("{} (CPU)", name),
-            value: name,
+            value: name.clone(),
             available,
         });
+        (available, log)
+    });
+
+    for ((name, desc), (available, log)) in all_audio.iter().zip(audio_results) {
+        if let Some(log) = log { report.log.push(log); }
+        if !available { continue; }
+        report.audio.push(DetectedEncoder {
+            name: format!("{} (CPU)", name),
+            value: name.clone(),
+            is_hardware: false,
+            description: desc.clone(),
+        });
     }
 
-    report
+    (report, timed_out.into_inner())
+}
+
+/// 硬件编码器家族对应的 `-init_hw_device` 设备类型
+fn hw_device_type(family: &str) -> Option<&'static str> {
+    match family {
+        "nvenc" | "cuda" => Some("cuda"),
+        "qsv" => Some("qsv"),
+        "vaapi" => Some("vaapi"),
+        "vdpau" => Some("vdpau"),
+        "amf" => Some("amf"),
+        "d3d12va" => Some("d3d12va"),
+        "vulkan" => Some("vulkan"),
+        "videotoolbox" => Some("videotoolbox"),
+        "mediacodec" => Some("mediacodec"),
+        _ => None,
+    }
+}
+
+/// 通过 `ffmpeg -init_hw_device list` 获取当前构建支持的硬件设备类型
+fn get_hw_device_types(ffmpeg_path: &str) -> Vec<String> {
+    let mut command = Command::new(ffmpeg_path);
+    command
+        .args(["-hide_banner", "-init_hw_device", "list"])
+        .stdout(Stdio::piped())
+        .stderr(Stdio::null());
+    #[cfg(windows)]
+    {
+        use std::os::windows::process::CommandExt;
+        command.creation_flags(0x08000000);
+    }
+
+    match output_with_timeout(&mut command, QUERY_TIMEOUT) {
+        Ok(o) => String::from_utf8_lossy(&o.stdout)
+            .lines()
+            .map(str::trim)
+            .filter(|l| !l.is_empty() && !l.ends_with(':'))
+            .map(str::to_string)
+            .collect(),
+        Err(_) => Vec::new(),
+    }
+}
+
+/// `ffmpeg -encoders` 的解析结果：(视频编码器, 音频编码器)，元素为 (名称, 描述)
+type EncoderListing = (Vec<(String, String)>, Vec<(String, String)>);
+
+/// 获取 ffmpeg 的编码器列表。
+/// 成功且非空的结果按 ffmpeg 路径和文件修改时间缓存，重复检测时不再重新启动 ffmpeg；
+/// 无法取得修改时间（如通过 PATH 调用的裸 `ffmpeg`）时不缓存，以免 ffmpeg 更换后仍使用旧列表
+fn get_encoder_listing(ffmpeg_path: &str) -> Result<EncoderListing, String> {
+    use std::collections::HashMap;
+    use std::sync::{Mutex, OnceLock};
+    use std::time::SystemTime;
+
+    static CACHE: OnceLock<Mutex<HashMap<(String, SystemTime), EncoderListing>>> = OnceLock::new();
+
+    let modified = std::fs::metadata(ffmpeg_path).and_then(|m| m.modified()).ok();
+    let key = modified.map(|m| (ffmpeg_path.to_string(), m));
+    let cache = CACHE.get_or_init(|| Mutex::new(HashMap::new()));
+    if let Some(listing) = key.as_ref().and_then(|k| cache.lock().unwrap().get(k).cloned()) {
+        return Ok(listing);
+    }
+
+    let mut command = Command::new(ffmpeg_path);
+    command.arg("-encoders").stdout(Stdio::piped()).stderr(Stdio::null());
+    #[cfg(windows)]
+    {
+        use std::os::windows::process::CommandExt;
+        command.creation_flags(0x08000000);
+    }
+    let mut child = match command.spawn() {
+        Ok(c) => c,
+        Err(e) => return Err(format!("Failed to run ffmpeg: {}", e)),
+    };
+
+    // 在独立线程中边读边解析，不必先缓冲整个输出；主线程负责超时终止进程
+    let stdout = child.stdout.take().unwrap();
+    let parser = std::thread::spawn(move || {
+        let mut all_video = Vec::new();
+        let mut all_audio = Vec::new();
+
+        let mut reader = BufReader::new(stdout);
+        let mut buf = Vec::new();
+        loop {
+            buf.clear();
+            if !matches!(reader.read_until(b'\n', &mut buf), Ok(n) if n > 0) { break; }
+            match parse_encoder_line(&String::from_utf8_lossy(&buf)) {
+                Some(('V', name, description)) => all_video.push((name, description)),
+                Some(('A', name, description)) => all_audio.push((name, description)),
+                _ => {}
+            }
+        }
+        (all_video, all_audio)
+    });
+
+    match wait_with_timeout(&mut child, QUERY_TIMEOUT) {
+        Ok(status) if status.success() => {}
+        Ok(status) => return Err(format!("ffmpeg -encoders failed: {}", status)),
+        Err(ProbeError::Timeout) => return Err("ffmpeg -encoders timed out".to_string()),
+        Err(ProbeError::Failed(e)) => return Err(format!("Failed to run ffmpeg: {}", String::from_utf8_lossy(&e))),
+    }
+    let listing = parser.join().map_err(|_| "Failed to parse ffmpeg -encoders output".to_string())?;
+    if listing.0.is_empty() && listing.1.is_empty() {
+        return Err("ffmpeg -encoders returned no encoders".to_string());
+    }
+
+    if let Some(key) = key {
+        cache.lock().unwrap().insert(key, listing.clone());
+    }
+    Ok(listing)
+}
+
+/// 解析 `ffmpeg -encoders` 的一行，返回 (类型标志, 名称, 描述)
+fn parse_encoder_line(line: &str) -> Option<(char, String, String)> {
+    let line = line.trim();
+    if line.is_empty() || line.starts_with('-') || line.starts_with('=') { return None; }
+
+    // 直接在原字符串上切分，不构造中间 Vec
+    let (flags, rest) = line.split_once(char::is_whitespace)?;
+    let (name, description) = rest.trim_start().split_once(char::is_whitespace)?;
+    // 跳过表头的图例行（如 " V..... = Video"）
+    if name == "=" { return None; }
+
+    let kind = flags.chars().next()?;
+    Some((kind, name.to_string(), description.trim().to_string()))
+}
+
+/// 编码器探测失败的原因
+enum ProbeError {
+    /// 超过时限仍未结束，进程已被终止
+    Timeout,
+    /// ffmpeg 返回失败，附带其原始错误输出
+    Failed(Vec<u8>),
+}
+
+/// 等待子进程结束，超过 `timeout` 仍未结束则终止进程
+fn wait_with_timeout(child: &mut Child, timeout: Duration) -> Result<ExitStatus, ProbeError> {
+    let deadline = Instant::now() + timeout;
+    loop {
+        match child.try_wait() {
+            Ok(Some(status)) => return Ok(status),
+            Ok(None) if Instant::now() < deadline => std::thread::sleep(Duration::from_millis(20)),
+            Ok(None) => {
+                let _ = child.kill();
+                let _ = child.wait();
+                return Err(ProbeError::Timeout);
+            }
+            Err(e) => {
+                let _ = child.kill();
+                let _ = child.wait();
+                return Err(ProbeError::Failed(e.to_string().into_bytes()));
+            }
+        }
+    }
+}
+
+/// 运行命令并收集输出，超过 `timeout` 仍未结束则终止进程。
+/// stdout/stderr 由调用方设置，只有设为 piped 的管道才会被读取
+fn output_with_timeout(command: &mut Command, timeout: Duration) -> Result<Output, ProbeError> {
+    use std::io::Read;
+
+    fn drain<R: Read + Send + 'static>(pipe: Option<R>) -> Option<std::thread::JoinHandle<Vec<u8>>> {
+        pipe.map(|mut pipe| std::thread::spawn(move || {
+            let mut buf = Vec::new();
+            let _ = pipe.read_to_end(&mut buf);
+            buf
+        }))
+    }
+
+    command.stdin(Stdio::null());
+    let mut child = command.spawn().map_err(|e| ProbeError::Failed(e.to_string().into_bytes()))?;
+
+    // 在独立线程中读取管道，防止输出填满缓冲区导致子进程阻塞
+    let stdout_reader = drain(child.stdout.take());
+    let stderr_reader = drain(child.stderr.take());
+
+    let status = wait_with_timeout(&mut child, timeout)?;
+
+    Ok(Output {
+        status,
+        stdout: stdout_reader.and_then(|h| h.join().ok()).unwrap_or_default(),
+        stderr: stderr_reader.and_then(|h| h.join().ok()).unwrap_or_default(),
+    })
+}
+
+/// 运行一次编码器探测命令，失败时返回 ffmpeg 的错误输出
+fn probe_encoder(ffmpeg_path: &str, args: &[&str]) -> Result<(), ProbeError> {
+    let mut command = Command::new(ffmpeg_path);
+    command.args(args).stdout(Stdio::null()).stderr(Stdio::piped());
+    #[cfg(windows)]
+    {
+        use std::os::windows::process::CommandExt;
+        command.creation_flags(0x08000000);
+    }
+
+    // 硬件编码器初始化较慢（如 nvenc 可能需要一秒以上），给予更宽的时限
+    let o = output_with_timeout(&mut command, ENCODE_PROBE_TIMEOUT)?;
+    if o.status.success() {
+        Ok(())
+    } else {
+        Err(ProbeError::Failed(o.stderr))
+    }
+}
+
+/// 判断硬件编码器的失败是否源于设备或驱动缺失（而非编码参数问题）
+/// 设备错误通常出现在输出开头，其后还跟着若干通用报错行，因此需扫描完整输出
+fn is_device_error(stderr: &[u8]) -> bool {
+    HW_DEVICE_ERROR_MARKERS.iter().any(|m| {
+        stderr.windows(m.len()).any(|w| w.eq_ignore_ascii_case(m.as_bytes()))
+    })
+}
+
+/// 取错误输出的最后 `n` 个非空行，只解码这几行
+fn stderr_tail(stderr: &[u8], n: usize) -> String {
+    let mut lines: Vec<String> = stderr
+        .rsplit(|&b| b == b'\n')
+        .map(|l| String::from_utf8_lossy(l).trim().to_string())
+        .filter(|l| !l.is_empty())
+        .take(n)
+        .collect();
+    lines.reverse();
+    lines.join(" | ")
+}
+
+/// 使用有限的工作线程并发执行 `f`，返回结果与 `items` 顺序一致。
+/// 并发数上限为 min(32, CPU 核数 * 2)，避免同时拉起过多 ffmpeg 进程
+fn run_parallel<T, R, F>(items: &[T], f: F) -> Vec<R>
+where
+    T: Sync,
+    R: Send,
+    F: Fn(&T) -> R + Sync,
+{
+    use std::sync::atomic::{AtomicUsize, Ordering};
+
+    let workers = std::thread::available_parallelism()
+        .map(|n| n.get() * 2)
+        .unwrap_or(4)
+        .min(32)
+        .min(items.len());
+    let next = AtomicUsize::new(0);
+    let results: std::sync::Mutex<Vec<Option<R>>> =
+        std::sync::Mutex::new((0..items.len()).map(|_| None).collect());
+
+    std::thread::scope(|s| {
+        for _ in 0..workers {
+            s.spawn(|| loop {
+                let i = next.fetch_add(1, Ordering::Relaxed);
+                if i >= items.len() { break; }
+                let r = f(&items[i]);
+                results.lock().unwrap()[i] = Some(r);
+            });
+        }
+    });
+
+    results
+        .into_inner()
+        .unwrap()
+        .into_iter()
+        .map(|r| r.expect("every item is processed by a worker"))
+        .collect()
 }
 
 pub fn get_metadata(path: &str, ffprobe_path: &str) -> Result<VideoInfo, String> {